@@ -0,0 +1,16 @@
+import os
+
+# Gunicorn settings for production: gunicorn -c gunicorn.conf.py main:app
+pythonpath = 'src'
+bind = '0.0.0.0:25000'
+
+# Worker processes serving requests from a thread pool. Threads release the GIL
+# while waiting on SQLite, the Node.js server or the agent, so one worker is the
+# default. SQLite writes from several workers are serialized by busy_timeout and
+# retried; only the AGENT_UES_CACHE_TTL cache assumes a single process.
+worker_class = 'gthread'
+workers = int(os.environ.get('GUNICORN_WORKERS', '1'))
+threads = int(os.environ.get('GUNICORN_THREADS', '32'))
+
+# Forwards to the Node.js server can wait up to its 120 s read timeout
+timeout = 150
@@ -1,12 +1,60 @@
 import sqlite3
+import functools
 import logging
 import os
-from typing import Optional
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
 
 # Database path relative to middleware directory
 _BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 _DATA_DIR = os.path.join(_BASE_DIR, 'data')
-DB_PATH = os.path.join(_DATA_DIR, 'requests.db')
+DB_PATH = os.environ.get('TRUEMAN_DB_PATH', os.path.join(_DATA_DIR, 'requests.db'))
+
+# DB_PATH value selecting a process-wide shared in-memory database (tests only)
+IN_MEMORY_DB = ':memory:'
+_MEMORY_URI = 'file::memory:?cache=shared'
+# A shared in-memory database is destroyed when its last connection closes
+_memory_anchor: Optional[sqlite3.Connection] = None
+
+# Schema version stored in PRAGMA user_version. To change the schema, bump it and
+# add the statements that upgrade a database from the previous version.
+SCHEMA_VERSION = 2
+
+# The requests table is keyed only by its TEXT id, so it is stored WITHOUT ROWID
+# as a single b-tree on id rather than a rowid table plus a separate id index.
+_REQUESTS_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS {table}
+                 (id TEXT PRIMARY KEY,
+                  private_key TEXT NOT NULL,
+                  contract_address TEXT NOT NULL,
+                  shared_tac TEXT NOT NULL,
+                  ue_imsis_json TEXT NOT NULL,
+                  duration_mins INTEGER,
+                  tenant_plmn TEXT,
+                  tenant_amf_ip TEXT,
+                  tenant_amf_port INTEGER,
+                  tenant_nssai_json TEXT,
+                  gtp_addr TEXT,
+                  tdd_config INTEGER,
+                  amf_addr TEXT,
+                  nssai_json TEXT,
+                  plmn TEXT,
+                  tac INTEGER,
+                  external_requestId TEXT UNIQUE,
+                  state TEXT DEFAULT 'Pending' CHECK(LOWER(state) IN ('created', 'pending', 'accepted', 'rejected', 'completed')),
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP) WITHOUT ROWID'''
+
+_MIGRATIONS = {
+    # 2: rebuild the rowid table as WITHOUT ROWID
+    2: (
+        _REQUESTS_TABLE_SQL.format(table='requests_new'),
+        "INSERT INTO requests_new SELECT * FROM requests",
+        "DROP TABLE requests",
+        "ALTER TABLE requests_new RENAME TO requests",
+    ),
+}
 
 # Fields that can be updated in the requests table
 UPDATABLE_FIELDS = {
@@ -16,89 +64,197 @@ UPDATABLE_FIELDS = {
     'nssai_json', 'plmn', 'tac', 'external_requestId', 'state'
 }
 
+# NOT NULL columns that must be supplied when a request is first inserted
+_REQUIRED_FIELDS = ('private_key', 'contract_address', 'shared_tac', 'ue_imsis_json')
+
+@functools.lru_cache(maxsize=64)
+def _build_upsert_sql(columns: tuple) -> str:
+    """Build the INSERT ... ON CONFLICT statement that writes exactly columns.
+
+    Statements are cached per column set, so each call shape is built once and
+    reuses the connection's prepared statement. Required columns that are not
+    written fall back to the existing row inside VALUES, because SQLite checks
+    NOT NULL before it detects the conflict.
+    """
+    insert_columns = list(columns) + [col for col in _REQUIRED_FIELDS if col not in columns]
+    values = [f":{col}" if col in columns else f"(SELECT {col} FROM requests WHERE id = :id)"
+              for col in insert_columns]
+    sql = f"INSERT INTO requests (id, {', '.join(insert_columns)}) VALUES (:id, {', '.join(values)}) "
+    if not columns:
+        return sql + "ON CONFLICT(id) DO NOTHING"
+    updates = ', '.join(f"{col} = excluded.{col}" for col in columns)
+    return sql + f"ON CONFLICT(id) DO UPDATE SET {updates}"
+
+# Fixed statement texts, so pooled connections reuse their cached prepared statements
+_SELECT_ID_SQL = "SELECT id FROM requests WHERE external_requestId = ?"
+_SELECT_DATA_SQL = "SELECT * FROM requests WHERE external_requestId = ?"
+
+# Result column names per SQL text; cleared by init_db in case the schema changed
+_COLUMN_NAMES: dict = {}
+
+def _column_names(sql: str, cursor: sqlite3.Cursor) -> tuple:
+    """Return the result column names of sql, read from cursor on first use."""
+    names = _COLUMN_NAMES.get(sql)
+    if names is None:
+        names = _COLUMN_NAMES[sql] = tuple(d[0] for d in cursor.description)
+    return names
+
+# Per-connection tuning; journal_mode=WAL is persistent and set once in init_db
+_CONNECTION_PRAGMAS = (
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-64000',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA busy_timeout=5000',
+)
+
+# Extra attempts for a write that fails with "database is locked"
+WRITE_RETRIES = 3
+
+# Idle connections kept open between calls, as (db_path, connection) pairs
+POOL_SIZE = 8
+_POOL: queue.Queue = queue.Queue(maxsize=POOL_SIZE)
+# SQLite allows one writer at a time; writers in this process wait here instead
+# of polling the database lock, and readers are not blocked (WAL)
+_WRITE_LOCK = threading.Lock()
+
+def _connect(path: str) -> sqlite3.Connection:
+    """Open an autocommit connection to path with the tuning PRAGMAs applied."""
+    global _memory_anchor
+    if path == IN_MEMORY_DB:
+        if _memory_anchor is None:
+            _memory_anchor = sqlite3.connect(_MEMORY_URI, uri=True, check_same_thread=False)
+        conn = sqlite3.connect(_MEMORY_URI, uri=True, check_same_thread=False, isolation_level=None)
+    else:
+        conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    for pragma in _CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+@contextmanager
+def get_conn() -> Iterator[sqlite3.Connection]:
+    """Borrow a pooled connection to DB_PATH, opening one if none is idle.
+
+    Pooled connections opened for a different DB_PATH are discarded.
+    """
+    path = DB_PATH
+    conn = None
+    while conn is None:
+        try:
+            conn_path, conn = _POOL.get_nowait()
+        except queue.Empty:
+            conn_path, conn = path, _connect(path)
+        if conn_path != path:
+            conn.close()
+            conn = None
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            _POOL.put_nowait((path, conn))
+        except queue.Full:
+            conn.close()
+
+def _migrate(conn: sqlite3.Connection):
+    """Bring an existing database up to SCHEMA_VERSION, one version per transaction.
+
+    The version is read after taking the write lock, so a migration another
+    process applied meanwhile is skipped instead of run twice.
+    """
+    # Databases created before versioning report 0 and have the version 1 schema
+    for target in range(2, SCHEMA_VERSION + 1):
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= target:
+            conn.rollback()
+            continue
+        for statement in _MIGRATIONS[target]:
+            conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {target}")
+        conn.commit()
+        logging.info("Database migrated to schema version %s.", target)
+
 def init_db():
-    # Ensure data directory exists
-    os.makedirs(_DATA_DIR, exist_ok=True)
+    # Ensure the database file's directory exists (TRUEMAN_DB_PATH may point elsewhere)
+    if DB_PATH != IN_MEMORY_DB:
+        os.makedirs(os.path.dirname(DB_PATH) or '.', exist_ok=True)
     
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_conn() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
         c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS requests
-                     (id TEXT PRIMARY KEY,
-                      private_key TEXT NOT NULL,
-                      contract_address TEXT NOT NULL,
-                      shared_tac TEXT NOT NULL,
-                      ue_imsis_json TEXT NOT NULL,
-                      duration_mins INTEGER,
-                      tenant_plmn TEXT,
-                      tenant_amf_ip TEXT,
-                      tenant_amf_port INTEGER,
-                      tenant_nssai_json TEXT,
-                      gtp_addr TEXT,
-                      tdd_config INTEGER,
-                      amf_addr TEXT,
-                      nssai_json TEXT,
-                      plmn TEXT,
-                      tac INTEGER,
-                      external_requestId TEXT UNIQUE,
-                      state TEXT DEFAULT 'Pending' CHECK(LOWER(state) IN ('created', 'pending', 'accepted', 'rejected', 'completed')),
-                      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+        # Create the table and its version in one transaction, so a process starting
+        # alongside never sees a new table without its version
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'requests'")
+        existing = c.fetchone() is not None
+        if not existing:
+            c.execute(_REQUESTS_TABLE_SQL.format(table='requests'))
+            c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         conn.commit()
+        if existing:
+            _migrate(conn)
+        # external_requestId lookups use its UNIQUE index; refresh planner stats when stale
+        c.execute("PRAGMA optimize")
+    _COLUMN_NAMES.clear()
     logging.info("Database initialized.")
 
+def _upsert(request_id: str, fields: dict) -> Tuple[str, dict]:
+    """Return the UPSERT statement and parameters for the fields to write.
+
+    Fields that are None or not in UPDATABLE_FIELDS are skipped, so the stored
+    values are kept.
+    """
+    params = {k: v for k, v in fields.items() if v is not None and k in UPDATABLE_FIELDS}
+    sql = _build_upsert_sql(tuple(sorted(params)))
+    params['id'] = request_id
+    return sql, params
+
+def _write(sql: str, params: dict):
+    """Run an UPSERT statement, retrying with backoff while the database is locked.
+
+    busy_timeout already waits for competing writers; this covers writers that
+    still hit SQLITE_BUSY after it expires. The last error is re-raised.
+    """
+    for attempt in range(WRITE_RETRIES + 1):
+        try:
+            with _WRITE_LOCK, get_conn() as conn:
+                conn.execute(sql, params)
+            return
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) or attempt == WRITE_RETRIES:
+                raise
+            time.sleep(0.01 * 2 ** attempt)
+
 def save_request(request_id: str, **kwargs) -> bool:
     """Save or update a request. Pass fields as keyword arguments."""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            c = conn.cursor()
-            c.execute("SELECT 1 FROM requests WHERE id = ?", (request_id,))
-            exists = c.fetchone()
-            
-            if exists:
-                # Build update from provided kwargs
-                fields = {k: v for k, v in kwargs.items() if k in UPDATABLE_FIELDS and v is not None}
-                if fields:
-                    query = f"UPDATE requests SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?"
-                    c.execute(query, (*fields.values(), request_id))
-                    logging.info(f"Request {request_id} updated in database.")
-                else:
-                    logging.info(f"Request {request_id} exists, no fields to update.")
-            else:
-                # Insert new record with defaults
-                kwargs.setdefault('state', 'Pending')
-                columns = ['id'] + [k for k in UPDATABLE_FIELDS if k in kwargs]
-                values = [request_id] + [kwargs[k] for k in UPDATABLE_FIELDS if k in kwargs]
-                placeholders = ', '.join('?' * len(columns))
-                query = f"INSERT INTO requests ({', '.join(columns)}) VALUES ({placeholders})"
-                c.execute(query, values)
-                logging.info(f"Request {request_id} saved to database.")
-            
-            conn.commit()
+        _write(*_upsert(request_id, kwargs))
+        logging.info("Request %s saved to database.", request_id)
         return True
-    except Exception as e:
-        logging.error(f"Error saving request: {e}")
+    except Exception:
+        logging.exception("Error saving request")
         return False
 
 def get_request_id_by_external_requestId(external_requestId: str) -> Optional[str]:
     """Get request ID by transaction hash."""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_conn() as conn:
             c = conn.cursor()
-            c.execute("SELECT id FROM requests WHERE external_requestId = ?", (external_requestId,))
+            c.execute(_SELECT_ID_SQL, (external_requestId,))
             row = c.fetchone()
             return row[0] if row else None
-    except Exception as e:
-        logging.error(f"Error getting request ID by external_requestId: {e}")
+    except Exception:
+        logging.exception("Error getting request ID by external_requestId")
         return None
 
 def get_request_data_by_external_requestId(external_requestId: str) -> Optional[dict]:
     """Get full request data by transaction hash."""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.row_factory = sqlite3.Row
-            c = conn.cursor()
-            c.execute("SELECT * FROM requests WHERE external_requestId = ?", (external_requestId,))
+        with get_conn() as conn:
+            c = conn.execute(_SELECT_DATA_SQL, (external_requestId,))
             row = c.fetchone()
-            return dict(row) if row else None
-    except Exception as e:
-        logging.error(f"Error getting request data by external_requestId: {e}")
+            return dict(zip(_column_names(_SELECT_DATA_SQL, c), row)) if row else None
+    except Exception:
+        logging.exception("Error getting request data by external_requestId")
         return None
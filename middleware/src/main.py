@@ -1,24 +1,50 @@
 from flask import Flask
+from flask.json.provider import JSONProvider
+import atexit
 import logging
 import os
+import orjson
 from database import init_db
 from routes import api
+from utils import close_agent_session
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson, used by request.get_json() and jsonify()."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # Configuration from environment variables with defaults
 app.config['NODE_SERVER_URL'] = os.environ.get('NODE_SERVER_URL', 'http://localhost:3020/api')
 app.config['AGENT_URL'] = os.environ.get('AGENT_URL', 'http://localhost:28080')
+# Return 202 from /api/create and forward to the Node.js server in the background
+app.config['ASYNC_CREATE'] = os.environ.get('ASYNC_CREATE', 'false').lower() == 'true'
+# Return 202 from PATCH .../accepted and apply the configuration on the agent in the background
+app.config['ASYNC_ACCEPT'] = os.environ.get('ASYNC_ACCEPT', 'false').lower() == 'true'
+# UEs per update_ues call to the agent, sent concurrently; 0 sends all UEs in one call
+app.config['AGENT_UE_BATCH_SIZE'] = int(os.environ.get('AGENT_UE_BATCH_SIZE', '0'))
+# Seconds to reuse a get_all_ues response across accepted requests; 0 always asks the agent
+app.config['AGENT_UES_CACHE_TTL'] = float(os.environ.get('AGENT_UES_CACHE_TTL', '0'))
 
-# Initialize Database
+# Initialize Database (TRUEMAN_DB_PATH=:memory: selects an in-memory database, for tests only)
 init_db()
 
+# Close pooled agent connections cleanly when the process exits
+atexit.register(close_agent_session)
+
 # Register Blueprint
 app.register_blueprint(api)
 
 if __name__ == '__main__':
+    # Development server; production runs gunicorn (see gunicorn.conf.py)
     debug = os.environ.get('FLASK_ENV') != 'production'
     app.run(host='0.0.0.0', port=25000, debug=debug)
@@ -1,213 +1,413 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, current_app, request, jsonify
+from werkzeug.routing import BaseConverter
 import logging
+import threading
+import time
 import uuid
-import json
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+import orjson
 import requests
-from database import save_request, get_request_data_by_external_requestId, get_request_id_by_external_requestId
-from utils import call_agent_restart, call_agent_get_all_ues, call_agent_update_ues
+from database import save_request, get_request_data_by_external_requestId
+from utils import (call_agent_restart, call_agent_get_all_ues, call_agent_update_ues,
+                   create_pooled_session)
 
 api = Blueprint('api', __name__)
 
+# States accepted by PATCH /api/request/<external_requestId>/<state>, mapped to their stored name
+_STATE_NAMES = {'accepted': 'Accepted', 'rejected': 'Rejected', 'completed': 'Completed'}
+
+
+class RequestStateConverter(BaseConverter):
+    """Match only valid request states (case-insensitive) while routing."""
+    regex = f"(?i:{'|'.join(sorted(_STATE_NAMES))})"
+    # Lower weight than the default string converter, so it is tried first
+    weight = 50
+
+
+# Recorded before any route, so the converter exists when the routes are added to the app
+@api.record_once
+def _register_converters(state):
+    state.app.url_map.converters['reqstate'] = RequestStateConverter
+
+
+def _static_error(message: str, status: int) -> tuple:
+    """Serialize a fixed error body once, at import time."""
+    return orjson.dumps({"error": message}), status
+
+
+def _err(error: tuple):
+    """Build a JSON response from a _static_error body and status."""
+    body, status = error
+    return current_app.response_class(body, status=status, mimetype='application/json')
+
+
+_ERR_INVALID_JSON = _static_error("Invalid JSON format", 400)
+_ERR_NO_JSON = _static_error("No JSON data provided", 400)
+_ERR_MISSING_FIELDS = _static_error(
+    "Missing one of required fields: privateKey, contractAddress, sharedTAC, or ueImsis", 400)
+_ERR_NODE_FAILED = _static_error("Failed to process request on Node.js server", 500)
+_ERR_NO_REQUEST_ID = _static_error("No request ID received from server", 500)
+_ERR_FORWARD_FAILED = _static_error("Failed to forward request", 500)
+_ERR_RESTART_FAILED = _static_error("Failed to restart service on agent", 500)
+_ERR_INVALID_STATE = _static_error("Invalid state. Must be one of: accepted, rejected, completed", 400)
+_ERR_UPDATE_FAILED = _static_error("Failed to update request state", 500)
+
+
+# Keep-alive connections to the Node.js server, reused across requests
+_node_session = create_pooled_session()
+# (connect, read) seconds; the Node.js server waits for the transaction to be mined
+NODE_SERVER_TIMEOUT = (3, 120)
+_NODE_HEADERS = {"Content-Type": "application/json", "Accept": "application/json"}
+# Runs Node.js forwards when ASYNC_CREATE is enabled, so create returns immediately
+_forward_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='node-forward')
+
+
+def _post_to_node(node_server_url: str, payload: dict) -> requests.Response:
+    """POST payload to the Node.js server, encoded once with orjson."""
+    return _node_session.post(node_server_url, data=orjson.dumps(payload), headers=_NODE_HEADERS,
+                              timeout=NODE_SERVER_TIMEOUT)
+
+
+def _forward_create_request(request_id: str, node_server_url: str, payload: dict):
+    """Forward a saved create request to the Node.js server in the background.
+    
+    On success the request moves to Pending with its external_requestId; on
+    failure it stays Created and the error is logged.
+    """
+    try:
+        response = _post_to_node(node_server_url, payload)
+        if response.status_code != 200:
+            logging.error("Node.js server returned status %s for request %s", response.status_code, request_id)
+            return
+        external_requestId = orjson.loads(response.content).get('requestId')
+        if not external_requestId:
+            logging.error("Node.js server returned 200 but no requestId for request %s", request_id)
+            return
+        save_request(request_id, external_requestId=external_requestId, state='Pending')
+    except Exception:
+        logging.exception("Error forwarding request %s to Node.js", request_id)
+
+
+# Optional create payload keys stored unchanged, as (JSON key, column) pairs
+_CREATE_OPTIONAL_FIELDS = (
+    ('durationMins', 'duration_mins'),
+    ('tenantPLMN', 'tenant_plmn'),
+    ('tenantAMFIP', 'tenant_amf_ip'),
+    ('tenantAMFPort', 'tenant_amf_port'),
+)
+
+
+def _parse_create_payload(data) -> Optional[Tuple[dict, dict]]:
+    """Map a create payload onto request columns and the Node.js payload.
+    
+    Returns None if the payload is not an object or a required field is missing.
+    """
+    if not isinstance(data, dict):
+        return None
+    get = data.get
+    private_key = get('privateKey')
+    contract_address = get('contractAddress')
+    shared_tac = get('sharedTAC')
+    ue_imsis = get('ueImsis')
+    if not private_key or not contract_address or not shared_tac or not ue_imsis:
+        return None
+    
+    request_fields = {column: get(key) for key, column in _CREATE_OPTIONAL_FIELDS}
+    request_fields['private_key'] = private_key
+    request_fields['contract_address'] = contract_address
+    request_fields['shared_tac'] = shared_tac
+    # IMSIs and tenant NSSAI are stored as JSON strings
+    request_fields['ue_imsis_json'] = orjson.dumps(ue_imsis).decode()
+    tenant_nssai = get('tenantNSSAI')
+    request_fields['tenant_nssai_json'] = orjson.dumps(tenant_nssai).decode() if tenant_nssai else None
+    
+    payload = {
+        "privateKey": private_key,
+        "contractAddress": contract_address,
+        "numUsers": len(ue_imsis),
+        "durationMins": request_fields['duration_mins']
+    }
+    return request_fields, payload
+
+
 @api.route('/api/create', methods=['POST'])
 def create_request():
     try:
-        # Parse JSON payload
-        try:
-            data = request.get_json()
-        except Exception as e:
-            logging.error(f"Failed to parse JSON: {e}")
-            return jsonify({"error": "Invalid JSON format"}), 400
+        # None means a missing or malformed body
+        data = request.get_json(silent=True)
+        if data is None:
+            return _err(_ERR_INVALID_JSON)
         
         if not data:
-            return jsonify({"error": "No JSON data provided"}), 400
-        
-        # Extract and validate required fields
-        private_key = data.get('privateKey')
-        contract_address = data.get('contractAddress')
-        shared_TAC = data.get('sharedTAC')
-        ue_imsis = data.get('ueImsis', [])
-        
-        if not private_key or not contract_address or not shared_TAC or not ue_imsis:
-            return jsonify({"error": "Missing one of required fields: privateKey, contractAddress, sharedTAC, or ueImsis"}), 400
-        
-        # Store IMSIs as JSON list string
-        ue_imsi_str = json.dumps(ue_imsis) if ue_imsis else None
-        duration_mins = data.get('durationMins')
+            return _err(_ERR_NO_JSON)
         
-        tenant_PLMN = data.get('tenantPLMN')
-        tenant_AMF_IP = data.get('tenantAMFIP')
-        tenant_AMF_port = data.get('tenantAMFPort')
-        tenant_NSSAI = data.get('tenantNSSAI')
-        # Store tenant NSSAI as JSON list string
-        tenant_nssai_str = json.dumps(tenant_NSSAI) if tenant_NSSAI else None
-
-        # Save to DB
+        parsed = _parse_create_payload(data)
+        if parsed is None:
+            return _err(_ERR_MISSING_FIELDS)
+        request_fields, payload = parsed
+
         request_id = str(uuid.uuid4())
-        save_request(
-            request_id=request_id,
-            state='Created',
-            private_key=private_key,
-            contract_address=contract_address,
-            shared_tac=shared_TAC,
-            ue_imsis_json=ue_imsi_str,
-            duration_mins=duration_mins,
-            tenant_plmn=tenant_PLMN,
-            tenant_amf_ip=tenant_AMF_IP,
-            tenant_amf_port=tenant_AMF_port,
-            tenant_nssai_json=tenant_nssai_str
-        )
-        logging.info(f"Received create request: {data}")
-
-        # Forward to Node.js server
-        number_of_users = len(ue_imsis) if ue_imsis else 1
-        payload = {
-            "privateKey": private_key,
-            "contractAddress": contract_address,
-            "numUsers": number_of_users,
-            "durationMins": duration_mins
-        }
+        logging.info("Received create request %s for %s UEs", request_id, payload['numUsers'])
+
         node_server_base_url = current_app.config.get('NODE_SERVER_URL', "http://localhost:3020/api")
         node_server_url = f"{node_server_base_url}/create"
-        response = requests.post(node_server_url, json=payload)
+        
+        # Store the request before forwarding: the Node.js call can take up to 120 s,
+        # and the record must survive the worker stopping during it
+        save_request(request_id, state='Created', **request_fields)
+        
+        if current_app.config.get('ASYNC_CREATE', False):
+            # The background job moves the row to Pending
+            _forward_executor.submit(_forward_create_request, request_id, node_server_url, payload)
+            return jsonify({"id": request_id, "state": "Created"}), 202
+        
+        response = _post_to_node(node_server_url, payload)
         
         if response.status_code != 200:
-            logging.error(f"Node.js server returned status {response.status_code}")
-            return jsonify({"error": "Failed to process request on Node.js server"}), 500
+            logging.error("Node.js server returned status %s", response.status_code)
+            return _err(_ERR_NODE_FAILED)
         
-        response_data = response.json()
-        external_requestId = response_data.get('requestId') # Need to change the db
+        # Parse only to read the requestId; the body is returned to the client as-is
+        external_requestId = orjson.loads(response.content).get('requestId')
         if not external_requestId:
             logging.error("Node.js server returned 200 but no requestId")
-            return jsonify({"error": "No request ID received from server"}), 500
+            return _err(_ERR_NO_REQUEST_ID)
         
-        save_request(request_id, external_requestId=external_requestId, state='Pending')
-        return jsonify(response_data), 200
+        save_request(request_id, state='Pending', external_requestId=external_requestId)
+        return current_app.response_class(response.content, status=200, mimetype='application/json')
 
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error forwarding to Node.js: {e}")
-        return jsonify({"error": "Failed to forward request"}), 500
+    except requests.exceptions.RequestException:
+        logging.exception("Error forwarding to Node.js")
+        return _err(_ERR_FORWARD_FAILED)
     except Exception as e:
-        logging.error(f"Unexpected error: {e}")
+        logging.exception("Unexpected error")
         return jsonify({"error": str(e)}), 500
 
+# Columns of the stored request used to configure the tenant, read in one call
+_TENANT_FIELDS = itemgetter('tenant_amf_ip', 'tenant_amf_port', 'tenant_plmn', 'shared_tac',
+                            'tenant_nssai_json', 'ue_imsis_json')
+
+
+def _handle_final_state(request_data: dict, external_requestId: str, state_name: str):
+    """Record a rejected or completed request."""
+    request_id = request_data['id']
+    save_request(request_id, state=state_name)
+    logging.info("Request %s (external_requestId: %s) state updated to: %s", request_id, external_requestId, state_name)
+
+
+def _make_tac_restriction(shared_tac: Optional[int], tenant_plmn: str):
+    """Build the per-UE function that adds shared_tac to allowed_5gs_tais.
+    
+    The TAC and PLMN are fixed for the whole UE list, so they are bound once
+    here. The returned function returns True if it modified the UE.
+    """
+    new_tacs = [shared_tac] if shared_tac else []
+    
+    def add_restriction(ue: dict) -> bool:
+        if 'allowed_5gs_tais' not in ue:
+            ue['allowed_5gs_tais'] = {
+                "restriction_type": "not_allowed",
+                "tais": [{"plmn": tenant_plmn, "areas": [{"tacs": new_tacs.copy()}]}]
+            }
+            return True
+        if not shared_tac:
+            return False
+        
+        # Add shared_tac to the tacs list if not already present
+        modified = False
+        for tai in ue['allowed_5gs_tais'].get('tais', []):
+            for area in tai.get('areas', []):
+                tacs = area.setdefault('tacs', [])
+                if shared_tac not in tacs:
+                    tacs.append(shared_tac)
+                    modified = True
+        return modified
+    
+    return add_restriction
+
+
+# agent_url -> (expiry, get_all_ues response) when AGENT_UES_CACHE_TTL is set. It is
+# per process, so it is only coherent when a single middleware process talks to the agent
+_ues_cache = {}
+# agent_url -> number of invalidations, so a fetch that overlapped one is not cached
+_ues_cache_gen = {}
+_ues_cache_lock = threading.Lock()
+
+
+def _get_all_ues(agent_url: str):
+    """Call get_all_ues, reusing a successful response younger than AGENT_UES_CACHE_TTL.
+    
+    The raw body is cached and parsed by each caller, so modifying the parsed
+    UEs never changes the cached list.
+    """
+    ttl = current_app.config.get('AGENT_UES_CACHE_TTL', 0.0)
+    if ttl <= 0:
+        return call_agent_get_all_ues(agent_url)
+    
+    with _ues_cache_lock:
+        cached = _ues_cache.get(agent_url)
+        generation = _ues_cache_gen.get(agent_url, 0)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    
+    response = call_agent_get_all_ues(agent_url)
+    if response.status_code == 200:
+        with _ues_cache_lock:
+            # An update_ues finished while fetching, so the response may predate it
+            if _ues_cache_gen.get(agent_url, 0) == generation:
+                _ues_cache[agent_url] = (time.monotonic() + ttl, response)
+    return response
+
+
+def _invalidate_ues_cache(agent_url: str):
+    """Drop the cached UE list once update_ues may have changed it on the agent."""
+    with _ues_cache_lock:
+        _ues_cache.pop(agent_url, None)
+        _ues_cache_gen[agent_url] = _ues_cache_gen.get(agent_url, 0) + 1
+
+
+def _handle_accepted(request_data: dict, external_requestId: str, state_name: str):
+    """Apply the tenant configuration on the agent for an accepted request.
+    
+    Returns an error response if the request cannot be applied, otherwise None.
+    """
+    request_id = request_data['id']
+    tenant_amf_ip, tenant_amf_port, tenant_plmn, shared_tac_raw, tenant_nssai_json, ue_imsis_json = \
+        _TENANT_FIELDS(request_data)
+    shared_tac = int(shared_tac_raw) if shared_tac_raw else None
+    
+    # Call the agent to restart the service with tenant configuration
+    agent_url = current_app.config.get('AGENT_URL', 'http://localhost:4000/resource/1')
+    
+    # Parse tenant NSSAI JSON if it exists
+    nssai_tenant = orjson.loads(tenant_nssai_json) if tenant_nssai_json else None
+    
+    # Build AMF address with port for tenant if both IP and port exist
+    tenant_amf_addr = f"{tenant_amf_ip}:{tenant_amf_port}" if tenant_amf_ip and tenant_amf_port else tenant_amf_ip
+    
+    response = call_agent_restart(
+        agent_url=agent_url,
+        amf_addr_tenant=tenant_amf_addr,
+        nssai_tenant=nssai_tenant,
+        plmn_tenant=tenant_plmn,
+        tac_tenant=shared_tac
+    )
+    if response.status_code != 200:
+        logging.error("Failed to restart service on agent for request %s", request_id)
+        return _err(_ERR_RESTART_FAILED)
+    
+    # Get all UEs and update TAC restrictions for UEs not in ue_imsis
+    ues_response = _get_all_ues(agent_url)
+    if ues_response.status_code == 200:
+        try:
+            all_ues = orjson.loads(ues_response.content).get('ues', [])
+            
+            # Get ue_imsis from request data, as a set for the per-UE membership test
+            ue_imsis = frozenset(orjson.loads(ue_imsis_json)) if ue_imsis_json else frozenset()
+            
+            # UEs whose IMSI is NOT in ue_imsis, keeping only those whose restriction changed
+            add_restriction = _make_tac_restriction(shared_tac, tenant_plmn or '00101')
+            ues_to_update = [ue for ue in all_ues
+                             if ue.get('imsi') not in ue_imsis and add_restriction(ue)]
+            
+            # Update UEs with modified TAC restrictions
+            if ues_to_update:
+                update_response = call_agent_update_ues(agent_url, ues_to_update,
+                                                        current_app.config.get('AGENT_UE_BATCH_SIZE', 0))
+                # Even a failed update may have applied some batches
+                _invalidate_ues_cache(agent_url)
+                    
+                if update_response.status_code != 200:
+                    logging.error("Failed to update UEs TAC restrictions for request %s", request_id)
+                    save_request(request_id, state='Accepted')
+                    logging.info("Request %s state updated to Accepted (UE update failed)", request_id)
+                else:
+                    logging.info("Updated TAC restrictions for %s UEs", len(ues_to_update))
+                    save_request(request_id, state='Completed')
+                    logging.info("Request %s state updated to Completed", request_id)
+            else:
+                # No UEs to update, mark as completed
+                save_request(request_id, state='Completed')
+                logging.info("Request %s state updated to Completed (no UEs to update)", request_id)
+        except ValueError:
+            logging.exception("Failed to parse UEs response")
+            save_request(request_id, state='Accepted')
+            logging.info("Request %s state updated to Accepted (parse error)", request_id)
+    else:
+        logging.error("Failed to get all UEs from agent: %s", ues_response.status_code)
+        save_request(request_id, state='Accepted')
+        logging.info("Request %s state updated to Accepted (get UEs failed)", request_id)
+
+
+_STATE_HANDLERS = {
+    'accepted': _handle_accepted,
+    'rejected': _handle_final_state,
+    'completed': _handle_final_state,
+}
+
+# Runs the agent calls for accepted requests when ASYNC_ACCEPT is enabled
+_accept_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='state-accept')
+
+
+def _accept_in_background(app, request_data: dict, external_requestId: str, state_name: str):
+    """Apply an accepted request off the request thread; on failure it stays Accepted."""
+    with app.app_context():
+        try:
+            if _handle_accepted(request_data, external_requestId, state_name):
+                logging.error("Failed to apply accepted request %s on agent", request_data['id'])
+        except Exception:
+            logging.exception("Error applying accepted request %s", request_data['id'])
+
+
 @api.route('/api/request/<external_requestId>/<state>', methods=['PATCH'])
+def invalid_request_state(external_requestId, state):
+    # Reached only when <state> did not match the reqstate converter
+    return _err(_ERR_INVALID_STATE)
+
+
+@api.route('/api/request/<external_requestId>/<reqstate:state>', methods=['PATCH'])
 def update_request_state(external_requestId, state):
     try:
-        # Validate state parameter
-        valid_states = ['accepted', 'rejected', 'completed']
-        if state.lower() not in valid_states:
-            return jsonify({"error": f"Invalid state. Must be one of: {', '.join(valid_states)}"}), 400
+        # State was validated by the reqstate converter
+        state_key = state.lower()
+        state_name = _STATE_NAMES[state_key]
         
-        # Try to resolve UUID from external_requestId
-        request_id = get_request_id_by_external_requestId(external_requestId)
-        if not request_id:
+        # Read the stored request once; the handlers need its id and tenant fields
+        request_data = get_request_data_by_external_requestId(external_requestId)
+        if not request_data:
             return jsonify({"error": f"Request with external_requestId '{external_requestId}' not found"}), 404
 
         # Update state in DB
         try:
-            if state.lower() != 'accepted':
-                save_request(request_id, state=state.capitalize())
-                logging.info(f"Request {request_id} (external_requestId: {external_requestId}) state updated to: {state.capitalize()}")
+            if state_key == 'accepted' and current_app.config.get('ASYNC_ACCEPT', False):
+                # Record Accepted now; the background job moves it to Completed
+                save_request(request_data['id'], state=state_name)
+                _accept_executor.submit(_accept_in_background, current_app._get_current_object(),
+                                        request_data, external_requestId, state_name)
+                return jsonify({
+                    "success": True,
+                    "message": "Request accepted, applying configuration",
+                    "external_requestId": external_requestId,
+                    "state": state_name
+                }), 202
             
-            if state.lower() == 'accepted':
-                # Get request data from DB to pass to the agent
-                request_data = get_request_data_by_external_requestId(external_requestId)
-                if not request_data:
-                    logging.error(f"Failed to retrieve request data for external_requestId {external_requestId}")
-                    return jsonify({"error": "Failed to retrieve request data"}), 500
-                
-                # Call the agent to restart the service with tenant configuration
-                agent_url = current_app.config.get('AGENT_URL', 'http://localhost:4000/resource/1')
-                
-                # Parse tenant NSSAI JSON if it exists
-                nssai_tenant = json.loads(request_data.get('tenant_nssai_json')) if request_data.get('tenant_nssai_json') else None
-                
-                # Build AMF address with port for tenant if both IP and port exist
-                tenant_amf_addr = None
-                if request_data.get('tenant_amf_ip'):
-                    if request_data.get('tenant_amf_port'):
-                        tenant_amf_addr = f"{request_data.get('tenant_amf_ip')}:{request_data.get('tenant_amf_port')}"
-                    else:
-                        tenant_amf_addr = request_data.get('tenant_amf_ip')
-                
-                response = call_agent_restart(
-                    agent_url=agent_url,
-                    amf_addr_tenant=tenant_amf_addr,
-                    nssai_tenant=nssai_tenant,
-                    plmn_tenant=request_data.get('tenant_plmn'),
-                    tac_tenant=int(request_data.get('shared_tac')) if request_data.get('shared_tac') else None
-                )
-                if response.status_code != 200:
-                    logging.error(f"Failed to restart service on agent for request {request_id}")
-                    return jsonify({"error": "Failed to restart service on agent"}), 500
-                
-                # Get all UEs and update TAC restrictions for UEs not in ue_imsis
-                ues_response = call_agent_get_all_ues(agent_url)
-                if ues_response.status_code == 200:
-                    try:
-                        ues_data = ues_response.json()
-                        all_ues = ues_data.get('ues', [])
-                        
-                        # Get ue_imsis from request data
-                        ue_imsis = json.loads(request_data.get('ue_imsis_json', '[]')) if request_data.get('ue_imsis_json') else []
-                        shared_tac = int(request_data.get('shared_tac')) if request_data.get('shared_tac') else None
-                        
-                        # Filter UEs whose IMSI is NOT in ue_imsis
-                        ues_to_update = []
-                        for ue in all_ues:
-                            if ue.get('imsi') not in ue_imsis:
-                                # Add shared TAC to the allowed_5gs_tais restriction
-                                if 'allowed_5gs_tais' not in ue:
-                                    ue['allowed_5gs_tais'] = {
-                                        "restriction_type": "not_allowed",
-                                        "tais": [{"plmn": request_data.get('tenant_plmn', '00101'), "areas": [{"tacs": []}]}]
-                                    }
-                                
-                                # Add shared_tac to the tacs list if not already present
-                                if shared_tac:
-                                    for tai in ue['allowed_5gs_tais'].get('tais', []):
-                                        for area in tai.get('areas', []):
-                                            if shared_tac not in area.get('tacs', []):
-                                                area.setdefault('tacs', []).append(shared_tac)
-                                
-                                ues_to_update.append(ue)
-                        
-                        # Update UEs with modified TAC restrictions
-                        if ues_to_update:
-                            update_response = call_agent_update_ues(agent_url, ues_to_update)
-                                
-                            if update_response.status_code != 200:
-                                logging.error(f"Failed to update UEs TAC restrictions for request {request_id}")
-                                save_request(request_id, state='Accepted')
-                                logging.info(f"Request {request_id} state updated to Accepted (UE update failed)")
-                            else:
-                                logging.info(f"Updated TAC restrictions for {len(ues_to_update)} UEs")
-                                save_request(request_id, state='Completed')
-                                logging.info(f"Request {request_id} state updated to Completed")
-                        else:
-                            # No UEs to update, mark as completed
-                            save_request(request_id, state='Completed')
-                            logging.info(f"Request {request_id} state updated to Completed (no UEs to update)")
-                    except json.JSONDecodeError as e:
-                        logging.error(f"Failed to parse UEs response: {e}")
-                        save_request(request_id, state='Accepted')
-                        logging.info(f"Request {request_id} state updated to Accepted (parse error)")
-                else:
-                    logging.error(f"Failed to get all UEs from agent: {ues_response.status_code}")
-                    save_request(request_id, state='Accepted')
-                    logging.info(f"Request {request_id} state updated to Accepted (get UEs failed)")
+            error_response = _STATE_HANDLERS[state_key](request_data, external_requestId, state_name)
+            if error_response:
+                return error_response
             
             return jsonify({
                 "success": True,
-                "message": f"Request state updated to {state.capitalize()}",
+                "message": f"Request state updated to {state_name}",
                 "external_requestId": external_requestId,
-                "state": state.capitalize()
+                "state": state_name
             }), 200
             
-        except Exception as e:
-            logging.error(f"Error updating request state: {e}")
-            return jsonify({"error": "Failed to update request state"}), 500
+        except Exception:
+            logging.exception("Error updating request state")
+            return _err(_ERR_UPDATE_FAILED)
 
     except Exception as e:
-        logging.error(f"Unexpected error in update_request_state: {e}")
+        logging.exception("Unexpected error in update_request_state")
         return jsonify({"error": str(e)}), 500
\ No newline at end of file
@@ -1,12 +1,21 @@
-import json
+import functools
 import logging
-from typing import Optional, List, Dict, Any
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Tuple, Union
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Constants
 DEFAULT_GNB_ID = '1'
 CONTENT_TYPE_JSON = {"Content-Type": "application/json"}
+# (connect, read) seconds for agent calls
+AGENT_TIMEOUT = (3.0, 30.0)
+# Actions whose response body is data for the caller, returned unchanged
+_DATA_ACTIONS = frozenset(('get_all_ues',))
 
 # Parameter name mapping for restart action
 RESTART_PARAM_MAPPING = {
@@ -17,6 +26,34 @@ RESTART_PARAM_MAPPING = {
 }
 
 
+def create_pooled_session(pool_connections: int = 16, pool_maxsize: int = 64) -> requests.Session:
+    """Create a Session that keeps connections alive across calls.
+    
+    Failed connection attempts are retried twice with backoff; 502/503/504
+    responses are retried only for idempotent methods, and the last response
+    is returned instead of raising.
+    """
+    # read=0: a request that reached the server is never re-sent after a read error
+    retry = Retry(total=2, connect=2, read=0, backoff_factor=0.1, status_forcelist=[502, 503, 504],
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# Shared by all agent calls so repeated calls to the same agent reuse connections
+_SESSION = create_pooled_session()
+# Sends update_ues batches to the agent concurrently
+_BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix='agent-batch')
+
+
+def close_agent_session():
+    """Close the pooled agent connections, e.g. on shutdown."""
+    _SESSION.close()
+
+
 def _build_payload(action: str, action_parameters: Optional[Any] = None) -> dict:
     """Build the agent request payload."""
     payload = {
@@ -34,46 +71,78 @@ def _build_payload(action: str, action_parameters: Optional[Any] = None) -> dict
     return payload
 
 
-def _create_error_response(status_code: int = 500, message: str = "Internal Server Error") -> requests.Response:
+@functools.lru_cache(maxsize=256)
+def _resource_url(agent_url: str) -> str:
+    """Resource URL of the default gNodeB on the agent at agent_url."""
+    return f"{agent_url.rstrip('/')}/resource/{DEFAULT_GNB_ID}"
+
+
+@functools.lru_cache(maxsize=None)
+def _static_body(action: str) -> bytes:
+    """Encoded payload of an action sent without parameters, built once per action."""
+    return orjson.dumps(_build_payload(action))
+
+
+# Returned instead of a requests.Response when the agent could not be reached or
+# answered with an error status; callers only read status_code and the body
+_ErrorResponse = namedtuple('_ErrorResponse', ['status_code', 'content', 'text', 'ok'])
+
+
+def _create_error_response(status_code: int = 500, message: str = "Internal Server Error") -> _ErrorResponse:
     """Create an error response object."""
-    response = requests.Response()
-    response.status_code = status_code
-    response._content = message.encode('utf-8')
-    return response
+    return _ErrorResponse(status_code, message.encode('utf-8'), message, False)
+
 
+# What the call_agent* helpers return; only status_code, content, text and ok are common to both
+AgentResponse = Union[requests.Response, _ErrorResponse]
 
-def call_agent(action: str, agent_url: str, action_parameters: Optional[Any] = None) -> requests.Response:
+
+def call_agent(action: str, agent_url: str, action_parameters: Optional[Any] = None,
+               timeout: Tuple[float, float] = AGENT_TIMEOUT) -> AgentResponse:
     """Send a request to the agent.
     
     Args:
         action: The action to perform (e.g., 'restart', 'get_all_ues', 'update_ues')
         agent_url: Base URL of the agent
         action_parameters: Optional parameters for the action
+        timeout: (connect, read) timeout in seconds
     
     Returns:
-        Response object from the agent
+        Response object from the agent, or an _ErrorResponse if the call failed
     """
-    url = f"{agent_url.rstrip('/')}/resource/{DEFAULT_GNB_ID}"
-    payload = _build_payload(action, action_parameters)
+    url = _resource_url(agent_url)
+    body = orjson.dumps(_build_payload(action, action_parameters)) if action_parameters else _static_body(action)
     
-    logging.info(f"Sending action '{action}' to {url} with params: {action_parameters}")
+    logging.info("Sending action '%s' to %s", action, url)
+    # Parameters can hold the full UE list, so they are only logged at DEBUG
+    logging.debug("Action '%s' params: %s", action, action_parameters)
     
     try:
-        response = requests.patch(url, headers=CONTENT_TYPE_JSON, data=json.dumps(payload))
-        response.raise_for_status()
+        response = _SESSION.patch(url, headers=CONTENT_TYPE_JSON, data=body, timeout=timeout)
+        # Check the status directly instead of raising and catching an HTTPError
+        if response.status_code >= 400:
+            logging.error("Agent at %s responded with status %s", url, response.status_code)
+            return _create_error_response(response.status_code, response.text)
+        
+        if action in _DATA_ACTIONS:
+            # Keep the body for the caller to parse; it can be large, so only log its size
+            logging.info("Agent responded with status %s (%s bytes)", response.status_code, len(response.content))
+            return response
         
         if response.status_code == 200:
             response._content = f"Action '{action}' executed successfully.".encode('utf-8')
         
-        logging.info(f"Agent responded with status {response.status_code}: {response.text}")
+        # response.text decodes the body (and may detect its charset), so skip it unless logged
+        if logging.getLogger().isEnabledFor(logging.INFO):
+            logging.info("Agent responded with status %s: %s", response.status_code, response.text)
         return response
         
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Failed to call agent at {url}: {e}")
+    except requests.exceptions.RequestException:
+        logging.exception("Failed to call agent at %s", url)
         return _create_error_response()
 
 
-def call_agent_restart(agent_url: str, **kwargs) -> requests.Response:
+def call_agent_restart(agent_url: str, **kwargs) -> AgentResponse:
     """Send a restart request to the agent with tenant configuration.
     
     Args:
@@ -81,24 +150,35 @@ def call_agent_restart(agent_url: str, **kwargs) -> requests.Response:
         **kwargs: Tenant parameters (amf_addr_tenant, nssai_tenant, plmn_tenant, tac_tenant)
     """
     action_parameters = {
-        RESTART_PARAM_MAPPING[k]: v 
-        for k, v in kwargs.items() 
+        RESTART_PARAM_MAPPING[k]: v
+        for k, v in kwargs.items()
         if k in RESTART_PARAM_MAPPING and v is not None
     }
     return call_agent('restart', agent_url, action_parameters or None)
 
 
-def call_agent_get_all_ues(agent_url: str) -> requests.Response:
+def call_agent_get_all_ues(agent_url: str) -> AgentResponse:
     """Get all UEs from the agent."""
     return call_agent('get_all_ues', agent_url)
 
 
-def call_agent_update_ues(agent_url: str, ues: List[Dict]) -> requests.Response:
+def call_agent_update_ues(agent_url: str, ues: List[Dict], batch_size: int = 0) -> AgentResponse:
     """Update UEs on the agent.
     
     Args:
         agent_url: Base URL of the agent
         ues: List of UE dictionaries containing sim_algo, imsi, opc, amf, sqn, K,
              pdn_list, impi, impu, and allowed_5gs_tais
+        batch_size: If set, send at most this many UEs per request, with the
+             requests running concurrently. Only for agents that apply each
+             update_ues call as a partial update.
+    
+    Returns:
+        The first failed response, or the last response if all succeeded
     """
-    return call_agent('update_ues', agent_url, ues)
+    if not batch_size or len(ues) <= batch_size:
+        return call_agent('update_ues', agent_url, ues)
+    
+    batches = [ues[i:i + batch_size] for i in range(0, len(ues), batch_size)]
+    responses = list(_BATCH_EXECUTOR.map(lambda batch: call_agent('update_ues', agent_url, batch), batches))
+    return next((r for r in responses if r.status_code != 200), responses[-1])
@@ -1,52 +1,149 @@
 import pytest
 import os
 import sqlite3
-import tempfile
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch
 
-# Patch DB_PATH before importing database module
+import database
+
+
 @pytest.fixture(autouse=True)
-def temp_db(tmp_path):
+def temp_db(tmp_path, monkeypatch):
     """Use a temporary database for each test."""
-    test_db_path = str(tmp_path / 'test_requests.db')
-    test_data_dir = str(tmp_path)
-    
-    with patch('database._DATA_DIR', test_data_dir), \
-         patch('database.DB_PATH', test_db_path):
-        # Import after patching
-        import database
-        database._DATA_DIR = test_data_dir
-        database.DB_PATH = test_db_path
-        database.init_db()
-        yield database
-        
+    monkeypatch.setattr(database, '_DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'test_requests.db'))
+    database.init_db()
+    yield database
+
+
+def _row(db, request_id):
+    """Read a stored request by id, with columns accessible by name."""
+    conn = sqlite3.connect(db.DB_PATH)
+    conn.row_factory = sqlite3.Row
+    try:
+        return conn.execute("SELECT * FROM requests WHERE id = ?", (request_id,)).fetchone()
+    finally:
+        conn.close()
+
 
 class TestInitDb:
     def test_creates_data_directory(self, temp_db, tmp_path):
         """Test that init_db creates the data directory."""
         assert os.path.exists(tmp_path)
     
-    def test_creates_requests_table(self, temp_db):
-        """Test that init_db creates the requests table with correct schema."""
-        with sqlite3.connect(temp_db.DB_PATH) as conn:
-            c = conn.cursor()
-            c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='requests'")
-            assert c.fetchone() is not None
+    def test_creates_database_directory(self, temp_db, tmp_path, monkeypatch):
+        """Test that init_db creates a missing directory for a custom DB_PATH."""
+        db_path = tmp_path / 'nested' / 'dir' / 'requests.db'
+        monkeypatch.setattr(temp_db, 'DB_PATH', str(db_path))
+        
+        temp_db.init_db()
+        
+        assert db_path.exists()
     
-    def test_table_has_correct_columns(self, temp_db):
-        """Test that the requests table has all expected columns."""
+    def test_creates_requests_table(self, temp_db):
+        """Test that init_db creates the requests table with all expected columns."""
         expected_columns = {
             'id', 'private_key', 'contract_address', 'shared_tac', 'ue_imsis_json',
             'duration_mins', 'tenant_plmn', 'tenant_amf_ip', 'tenant_amf_port',
             'tenant_nssai_json', 'gtp_addr', 'tdd_config', 'amf_addr', 'nssai_json',
-            'plmn', 'tac', 'tx_hash', 'state', 'created_at'
+            'plmn', 'tac', 'external_requestId', 'state', 'created_at'
         }
         with sqlite3.connect(temp_db.DB_PATH) as conn:
             c = conn.cursor()
+            c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='requests'")
+            assert c.fetchone() is not None
             c.execute("PRAGMA table_info(requests)")
             actual_columns = {row[1] for row in c.fetchall()}
         
         assert expected_columns == actual_columns
+    
+    def test_sets_schema_version(self, temp_db):
+        """Test that init_db records the current schema version."""
+        with sqlite3.connect(temp_db.DB_PATH) as conn:
+            c = conn.cursor()
+            c.execute("PRAGMA user_version")
+            assert c.fetchone()[0] == temp_db.SCHEMA_VERSION
+    
+    def test_enables_wal(self, temp_db):
+        """Test that init_db switches the database file to WAL journaling."""
+        with sqlite3.connect(temp_db.DB_PATH) as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    
+    def test_table_is_without_rowid(self, temp_db):
+        """Test that the requests table is stored WITHOUT ROWID."""
+        with sqlite3.connect(temp_db.DB_PATH) as conn:
+            c = conn.cursor()
+            c.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='requests'")
+            assert c.fetchone()[0].endswith('WITHOUT ROWID')
+    
+    def test_migrates_rowid_table(self, temp_db):
+        """Test that a database from before versioning is rebuilt WITHOUT ROWID."""
+        legacy_sql = temp_db._REQUESTS_TABLE_SQL.format(table='requests').replace(' WITHOUT ROWID', '')
+        with sqlite3.connect(temp_db.DB_PATH) as conn:
+            c = conn.cursor()
+            c.execute("DROP TABLE requests")
+            c.execute(legacy_sql)
+            c.execute(
+                "INSERT INTO requests (id, private_key, contract_address, shared_tac, ue_imsis_json) "
+                "VALUES ('test-legacy', 'pk_test', '0xabc', '101', '[\"imsi1\"]')"
+            )
+            c.execute("PRAGMA user_version = 0")
+        
+        temp_db.init_db()
+        
+        with sqlite3.connect(temp_db.DB_PATH) as conn:
+            c = conn.cursor()
+            c.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='requests'")
+            assert c.fetchone()[0].endswith('WITHOUT ROWID')
+            c.execute("SELECT private_key FROM requests WHERE id = ?", ('test-legacy',))
+            assert c.fetchone()[0] == 'pk_test'
+            c.execute("PRAGMA user_version")
+            assert c.fetchone()[0] == temp_db.SCHEMA_VERSION
+    
+    def test_migrate_skips_applied_versions(self, temp_db):
+        """Test that a migration already applied by another process is not run again."""
+        temp_db.save_request(
+            request_id='test-migrated',
+            private_key='pk_test',
+            contract_address='0xabc',
+            shared_tac='101',
+            ue_imsis_json='["imsi1"]'
+        )
+        
+        class StaleVersionConn:
+            """Reports version 1 outside a transaction, as if read before another process migrated."""
+            def __init__(self, conn):
+                self._conn = conn
+            
+            def execute(self, sql, *args):
+                if sql == "PRAGMA user_version" and not self._conn.in_transaction:
+                    return self._conn.execute("SELECT 1")
+                return self._conn.execute(sql, *args)
+            
+            def __getattr__(self, name):
+                return getattr(self._conn, name)
+        
+        with temp_db.get_conn() as conn:
+            with patch.dict(temp_db._MIGRATIONS, {2: ("SELECT RAISE(ABORT, 'migration ran twice')",)}):
+                temp_db._migrate(StaleVersionConn(conn))
+            assert conn.execute("PRAGMA user_version").fetchone()[0] == temp_db.SCHEMA_VERSION
+        
+        assert _row(temp_db, 'test-migrated') is not None
+    
+    def test_reinit_keeps_existing_data(self, temp_db):
+        """Test that running init_db on an existing database keeps its rows."""
+        temp_db.save_request(
+            request_id='test-reinit',
+            private_key='pk_test',
+            contract_address='0xabc',
+            shared_tac='101',
+            ue_imsis_json='["imsi1"]'
+        )
+        
+        temp_db.init_db()
+        
+        assert _row(temp_db, 'test-reinit') is not None
 
 
 class TestSaveRequest:
@@ -62,15 +159,12 @@ class TestSaveRequest:
         assert result is True
         
         # Verify insertion
-        with sqlite3.connect(temp_db.DB_PATH) as conn:
-            c = conn.cursor()
-            c.execute("SELECT id, private_key, state FROM requests WHERE id = ?", ('test-123',))
-            row = c.fetchone()
+        row = _row(temp_db, 'test-123')
         
         assert row is not None
-        assert row[0] == 'test-123'
-        assert row[1] == 'pk_test'
-        assert row[2] == 'Pending'  # Default state
+        assert row['id'] == 'test-123'
+        assert row['private_key'] == 'pk_test'
+        assert row['state'] == 'Pending'  # Default state
     
     def test_insert_with_custom_state(self, temp_db):
         """Test inserting a request with a custom state."""
@@ -83,121 +177,155 @@ class TestSaveRequest:
             state='Created'
         )
         
-        with sqlite3.connect(temp_db.DB_PATH) as conn:
-            c = conn.cursor()
-            c.execute("SELECT state FROM requests WHERE id = ?", ('test-456',))
-            row = c.fetchone()
-        
-        assert row[0] == 'Created'
+        assert _row(temp_db, 'test-456')['state'] == 'Created'
     
-    def test_update_existing_request(self, temp_db):
-        """Test updating an existing request."""
-        # Insert first
+    @pytest.fixture
+    def seeded_row(self, temp_db):
+        """Insert a request for the update tests and return its id."""
         temp_db.save_request(
-            request_id='test-789',
+            request_id='test-seed',
             private_key='pk_test',
             contract_address='0xabc',
             shared_tac='101',
-            ue_imsis_json='["imsi1"]'
+            ue_imsis_json='["imsi1"]',
+            tenant_plmn='00101'
         )
-        
-        # Update
+        return 'test-seed'
+    
+    def test_update_existing_request(self, temp_db, seeded_row):
+        """Test updating an existing request."""
         result = temp_db.save_request(
-            request_id='test-789',
+            request_id=seeded_row,
             state='Accepted',
-            tx_hash='0xhash123'
+            external_requestId='0xhash123'
         )
         assert result is True
         
         # Verify update
-        with sqlite3.connect(temp_db.DB_PATH) as conn:
-            c = conn.cursor()
-            c.execute("SELECT state, tx_hash FROM requests WHERE id = ?", ('test-789',))
-            row = c.fetchone()
-        
-        assert row[0] == 'Accepted'
-        assert row[1] == '0xhash123'
+        row = _row(temp_db, seeded_row)
+        assert row['state'] == 'Accepted'
+        assert row['external_requestId'] == '0xhash123'
     
-    def test_update_with_no_fields_to_update(self, temp_db):
+    def test_update_with_no_fields_to_update(self, temp_db, seeded_row):
         """Test updating when no valid fields are provided."""
-        temp_db.save_request(
-            request_id='test-noupdate',
-            private_key='pk_test',
-            contract_address='0xabc',
-            shared_tac='101',
-            ue_imsis_json='["imsi1"]'
-        )
-        
         # Update with invalid field
         result = temp_db.save_request(
-            request_id='test-noupdate',
+            request_id=seeded_row,
             invalid_field='value'
         )
         assert result is True  # Should still succeed, just no updates
     
-    def test_ignores_none_values_on_update(self, temp_db):
+    def test_ignores_none_values_on_update(self, temp_db, seeded_row):
         """Test that None values are ignored during updates."""
-        temp_db.save_request(
-            request_id='test-none',
-            private_key='pk_test',
-            contract_address='0xabc',
-            shared_tac='101',
-            ue_imsis_json='["imsi1"]',
-            tenant_plmn='00101'
-        )
-        
         # Update with None value - should not overwrite
         temp_db.save_request(
-            request_id='test-none',
+            request_id=seeded_row,
             tenant_plmn=None,
             state='Accepted'
         )
         
-        with sqlite3.connect(temp_db.DB_PATH) as conn:
-            c = conn.cursor()
-            c.execute("SELECT tenant_plmn, state FROM requests WHERE id = ?", ('test-none',))
-            row = c.fetchone()
+        row = _row(temp_db, seeded_row)
+        assert row['tenant_plmn'] == '00101'  # Should remain unchanged
+        assert row['state'] == 'Accepted'
+    
+    def test_retries_when_database_locked(self, temp_db):
+        """Test that a write hitting a locked database is retried."""
+        real_get_conn = temp_db.get_conn
+        attempts = []
         
-        assert row[0] == '00101'  # Should remain unchanged
-        assert row[1] == 'Accepted'
+        @contextmanager
+        def locked_once():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise sqlite3.OperationalError("database is locked")
+            with real_get_conn() as conn:
+                yield conn
+        
+        with patch('database.get_conn', locked_once), \
+             patch('database.time.sleep') as mock_sleep:
+            result = temp_db.save_request(
+                request_id='test-locked',
+                private_key='pk_test',
+                contract_address='0xabc',
+                shared_tac='101',
+                ue_imsis_json='["imsi1"]'
+            )
+        
+        assert result is True
+        assert len(attempts) == 2
+        mock_sleep.assert_called_once()
+    
+    def test_gives_up_when_database_stays_locked(self, temp_db):
+        """Test that save_request returns False once retries are exhausted."""
+        @contextmanager
+        def always_locked():
+            raise sqlite3.OperationalError("database is locked")
+            yield
+        
+        with patch('database.get_conn', always_locked), \
+             patch('database.time.sleep') as mock_sleep:
+            result = temp_db.save_request(request_id='test-locked', state='Accepted')
+        
+        assert result is False
+        assert mock_sleep.call_count == temp_db.WRITE_RETRIES
+    
+    def test_concurrent_writes_from_threads(self, temp_db):
+        """Test that saves from several threads are all written."""
+        def save(i):
+            return temp_db.save_request(
+                request_id=f'test-thread-{i}',
+                private_key='pk_test',
+                contract_address='0xabc',
+                shared_tac='101',
+                ue_imsis_json='["imsi1"]'
+            )
+        
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(save, range(32)))
+        
+        assert all(results)
+        with sqlite3.connect(temp_db.DB_PATH) as conn:
+            count = conn.execute("SELECT COUNT(*) FROM requests WHERE id LIKE 'test-thread-%'").fetchone()[0]
+        assert count == 32
 
 
-class TestGetRequestIdByTxHash:
+class TestGetRequestIdByExternalRequestId:
     def test_returns_id_when_found(self, temp_db):
-        """Test getting request ID by tx_hash when it exists."""
+        """Test getting request ID by external_requestId when it exists."""
         temp_db.save_request(
             request_id='test-getid',
             private_key='pk_test',
             contract_address='0xabc',
             shared_tac='101',
             ue_imsis_json='["imsi1"]',
-            tx_hash='0xuniquehash'
+            external_requestId='0xuniquehash'
         )
         
-        result = temp_db.get_request_id_by_tx_hash('0xuniquehash')
+        result = temp_db.get_request_id_by_external_requestId('0xuniquehash')
         assert result == 'test-getid'
     
-    def test_returns_none_when_not_found(self, temp_db):
-        """Test getting request ID by tx_hash when it doesn't exist."""
-        result = temp_db.get_request_id_by_tx_hash('0xnonexistent')
-        assert result is None
+    @pytest.mark.parametrize('lookup', ['get_request_id_by_external_requestId',
+                                        'get_request_data_by_external_requestId'])
+    def test_returns_none_when_not_found(self, temp_db, lookup):
+        """Test that both lookups return None when no request matches."""
+        assert getattr(temp_db, lookup)('0xnonexistent') is None
 
 
-class TestGetRequestDataByTxHash:
+class TestGetRequestDataByExternalRequestId:
     def test_returns_full_data_when_found(self, temp_db):
-        """Test getting full request data by tx_hash."""
+        """Test getting full request data by external_requestId."""
         temp_db.save_request(
             request_id='test-fulldata',
             private_key='pk_test',
             contract_address='0xcontract',
             shared_tac='102',
             ue_imsis_json='["imsi1", "imsi2"]',
-            tx_hash='0xdatahash',
+            external_requestId='0xdatahash',
             tenant_plmn='00101',
             duration_mins=60
         )
         
-        result = temp_db.get_request_data_by_tx_hash('0xdatahash')
+        result = temp_db.get_request_data_by_external_requestId('0xdatahash')
         
         assert result is not None
         assert isinstance(result, dict)
@@ -206,32 +334,25 @@ class TestGetRequestDataByTxHash:
         assert result['contract_address'] == '0xcontract'
         assert result['shared_tac'] == '102'
         assert result['ue_imsis_json'] == '["imsi1", "imsi2"]'
-        assert result['tx_hash'] == '0xdatahash'
+        assert result['external_requestId'] == '0xdatahash'
         assert result['tenant_plmn'] == '00101'
         assert result['duration_mins'] == 60
         assert result['state'] == 'Pending'
-    
-    def test_returns_none_when_not_found(self, temp_db):
-        """Test getting request data by tx_hash when it doesn't exist."""
-        result = temp_db.get_request_data_by_tx_hash('0xnonexistent')
-        assert result is None
 
 
 class TestStateValidation:
-    def test_valid_states(self, temp_db):
-        """Test that all valid states are accepted."""
-        valid_states = ['Created', 'Pending', 'Accepted', 'Rejected', 'Completed']
-        
-        for i, state in enumerate(valid_states):
-            result = temp_db.save_request(
-                request_id=f'test-state-{i}',
-                private_key='pk_test',
-                contract_address='0xabc',
-                shared_tac='101',
-                ue_imsis_json='["imsi1"]',
-                state=state
-            )
-            assert result is True
+    @pytest.mark.parametrize('state', ['Created', 'Pending', 'Accepted', 'Rejected', 'Completed'])
+    def test_valid_states(self, temp_db, state):
+        """Test that each valid state is accepted."""
+        result = temp_db.save_request(
+            request_id=f'test-state-{state}',
+            private_key='pk_test',
+            contract_address='0xabc',
+            shared_tac='101',
+            ue_imsis_json='["imsi1"]',
+            state=state
+        )
+        assert result is True
     
     def test_invalid_state_rejected(self, temp_db):
         """Test that invalid states are rejected by the database."""
@@ -1,16 +1,18 @@
 import pytest
 import json
-import sqlite3
+import threading
+import requests
 from unittest.mock import patch, MagicMock
-from flask import Flask
 import database
+import routes
+import utils
 from main import app as flask_app
 
 
 @pytest.fixture(autouse=True)
 def mock_external_apis():
     """Automatically mock all external API calls for all tests."""
-    with patch('routes.requests.post') as mock_node_post, \
+    with patch('routes._node_session.post') as mock_node_post, \
          patch('routes.call_agent_restart') as mock_restart, \
          patch('routes.call_agent_get_all_ues') as mock_get_ues, \
          patch('routes.call_agent_update_ues') as mock_update_ues:
@@ -18,7 +20,7 @@ def mock_external_apis():
         # Default mock responses for Node.js server
         mock_node_response = MagicMock()
         mock_node_response.status_code = 200
-        mock_node_response.json.return_value = {"txHash": "0xmocked_hash"}
+        mock_node_response.content = json.dumps({"requestId": "0xmocked_hash"}).encode()
         mock_node_post.return_value = mock_node_response
         
         # Default mock responses for agent calls
@@ -28,7 +30,7 @@ def mock_external_apis():
         
         mock_ues_response = MagicMock()
         mock_ues_response.status_code = 200
-        mock_ues_response.json.return_value = {"ues": []}
+        mock_ues_response.content = json.dumps({"ues": []}).encode()
         mock_get_ues.return_value = mock_ues_response
         
         mock_update_response = MagicMock()
@@ -44,27 +46,18 @@ def mock_external_apis():
 
 
 @pytest.fixture
-def app(tmp_path):
+def app(monkeypatch):
     """Create and configure a test Flask app instance."""
-    test_db_path = str(tmp_path / 'test_requests.db')
-    test_data_dir = str(tmp_path)
+    # One in-memory database per process (so per xdist worker). Each test starts from an
+    # empty table, even if an earlier test's background job wrote after its teardown
+    monkeypatch.setattr(database, 'DB_PATH', database.IN_MEMORY_DB)
+    database.init_db()
+    with database.get_conn() as conn:
+        conn.execute("DELETE FROM requests")
     
-    with patch('database._DATA_DIR', test_data_dir), \
-         patch('database.DB_PATH', test_db_path):
-        
-        
-        database._DATA_DIR = test_data_dir
-        database.DB_PATH = test_db_path
-        
-        # Initialize database with test path
-        database.init_db()
-        
-        # Configure test app
-        flask_app.config['TESTING'] = True
-        flask_app.config['NODE_SERVER_URL'] = 'http://localhost:3020/api'
-        flask_app.config['AGENT_URL'] = 'http://localhost:28080'
-        
-        yield flask_app
+    flask_app.config['TESTING'] = True
+    
+    yield flask_app
 
 
 @pytest.fixture
@@ -94,11 +87,11 @@ class TestCreateRequestIntegration:
     
     def test_create_request_success(self, client, sample_create_payload):
         """Test successful request creation with all fields."""
-        with patch('routes.requests.post') as mock_post:
+        with patch('routes._node_session.post') as mock_post:
             # Mock successful Node.js response
             mock_response = MagicMock()
             mock_response.status_code = 200
-            mock_response.json.return_value = {"txHash": "0xtxhash123"}
+            mock_response.content = json.dumps({"requestId": "0xrequest123"}).encode()
             mock_post.return_value = mock_response
             
             response = client.post('/api/create', 
@@ -107,14 +100,15 @@ class TestCreateRequestIntegration:
             
             assert response.status_code == 200
             data = json.loads(response.data)
-            assert 'txHash' in data
-            assert data['txHash'] == '0xtxhash123'
+            assert 'requestId' in data
+            assert data['requestId'] == '0xrequest123'
             
             # Verify Node.js was called with correct payload
             mock_post.assert_called_once()
             call_args = mock_post.call_args
-            assert call_args[1]['json']['privateKey'] == sample_create_payload['privateKey']
-            assert call_args[1]['json']['numUsers'] == 2
+            sent = json.loads(call_args[1]['data'])
+            assert sent['privateKey'] == sample_create_payload['privateKey']
+            assert sent['numUsers'] == 2
     
     def test_create_request_minimal_payload(self, client):
         """Test request creation with only required fields."""
@@ -125,10 +119,10 @@ class TestCreateRequestIntegration:
             "ueImsis": ["001010000000003"]
         }
         
-        with patch('routes.requests.post') as mock_post:
+        with patch('routes._node_session.post') as mock_post:
             mock_response = MagicMock()
             mock_response.status_code = 200
-            mock_response.json.return_value = {"txHash": "0xtxhash456"}
+            mock_response.content = json.dumps({"requestId": "0xrequest456"}).encode()
             mock_post.return_value = mock_response
             
             response = client.post('/api/create', 
@@ -137,15 +131,13 @@ class TestCreateRequestIntegration:
             
             assert response.status_code == 200
             data = json.loads(response.data)
-            assert data['txHash'] == '0xtxhash456'
+            assert data['requestId'] == '0xrequest456'
     
-    def test_create_request_missing_required_field(self, client):
-        """Test that missing required fields return 400 error."""
-        incomplete_payload = {
-            "privateKey": "0xtest123",
-            "contractAddress": "0xcontract123"
-            # Missing sharedTAC and ueImsis
-        }
+    @pytest.mark.parametrize('missing', ['privateKey', 'contractAddress', 'sharedTAC', 'ueImsis'])
+    def test_create_request_missing_required_field(self, client, sample_create_payload, missing):
+        """Test that a missing required field returns 400 error."""
+        incomplete_payload = dict(sample_create_payload)
+        del incomplete_payload[missing]
         
         response = client.post('/api/create', 
                               json=incomplete_payload,
@@ -156,6 +148,14 @@ class TestCreateRequestIntegration:
         assert 'error' in data
         assert 'Missing' in data['error']
     
+    def test_create_request_non_object_payload(self, client):
+        """Test that a JSON body that is not an object returns 400."""
+        response = client.post('/api/create', json=["privateKey", "contractAddress"])
+        
+        assert response.status_code == 400
+        data = json.loads(response.data)
+        assert 'Missing' in data['error']
+    
     def test_create_request_no_json_data(self, client):
         """Test that request without JSON data returns 400."""
         response = client.post('/api/create', 
@@ -169,7 +169,7 @@ class TestCreateRequestIntegration:
     
     def test_create_request_node_server_failure(self, client, sample_create_payload):
         """Test handling of Node.js server failures."""
-        with patch('routes.requests.post') as mock_post:
+        with patch('routes._node_session.post') as mock_post:
             # Mock Node.js server error
             mock_response = MagicMock()
             mock_response.status_code = 500
@@ -184,13 +184,45 @@ class TestCreateRequestIntegration:
             assert 'error' in data
             assert 'Failed to process request' in data['error']
     
-    def test_create_request_node_server_no_txhash(self, client, sample_create_payload):
-        """Test handling when Node.js returns 200 but no txHash."""
-        with patch('routes.requests.post') as mock_post:
-            # Mock Node.js response without txHash
+    def test_create_request_node_server_failure_saves_created(self, client, sample_create_payload):
+        """Test that a request the Node.js server rejects is still saved as Created."""
+        with patch('routes._node_session.post') as mock_post:
+            mock_response = MagicMock()
+            mock_response.status_code = 500
+            mock_post.return_value = mock_response
+            
+            response = client.post('/api/create', 
+                                  json=sample_create_payload,
+                                  content_type='application/json')
+            
+            assert response.status_code == 500
+            with database.get_conn() as conn:
+                rows = conn.execute("SELECT state, external_requestId FROM requests").fetchall()
+            assert rows == [('Created', None)]
+    
+    def test_create_request_saved_before_forwarding(self, client, sample_create_payload):
+        """Test that the request is stored as Created while the Node.js call is in flight."""
+        states_during_call = []
+        
+        def post(*args, **kwargs):
+            with database.get_conn() as conn:
+                states_during_call.extend(conn.execute("SELECT state FROM requests").fetchall())
+            return MagicMock(status_code=200, content=b'{"requestId": "0xinflight"}')
+        
+        with patch('routes._node_session.post', side_effect=post):
+            response = client.post('/api/create', json=sample_create_payload)
+        
+        assert response.status_code == 200
+        assert states_during_call == [('Created',)]
+        assert database.get_request_data_by_external_requestId('0xinflight')['state'] == 'Pending'
+    
+    def test_create_request_node_server_no_request_id(self, client, sample_create_payload):
+        """Test handling when Node.js returns 200 but no requestId."""
+        with patch('routes._node_session.post') as mock_post:
+            # Mock Node.js response without requestId
             mock_response = MagicMock()
             mock_response.status_code = 200
-            mock_response.json.return_value = {"message": "success"}
+            mock_response.content = json.dumps({"message": "success"}).encode()
             mock_post.return_value = mock_response
             
             response = client.post('/api/create', 
@@ -200,13 +232,12 @@ class TestCreateRequestIntegration:
             assert response.status_code == 500
             data = json.loads(response.data)
             assert 'error' in data
-            assert 'No transaction hash' in data['error']
+            assert 'No request ID' in data['error']
     
     def test_create_request_connection_error(self, client, sample_create_payload):
         """Test handling of connection errors to Node.js server."""
-        with patch('routes.requests.post') as mock_post:
-            import requests as req_module
-            mock_post.side_effect = req_module.exceptions.ConnectionError()
+        with patch('routes._node_session.post') as mock_post:
+            mock_post.side_effect = requests.exceptions.ConnectionError()
             
             response = client.post('/api/create', 
                                   json=sample_create_payload,
@@ -217,14 +248,35 @@ class TestCreateRequestIntegration:
             assert 'error' in data
             assert 'Failed to forward request' in data['error']
     
-    def test_create_request_database_persistence(self, client, sample_create_payload, tmp_path):
-        """Test that request data is properly saved to database."""
-        with patch('routes.requests.post') as mock_post, \
-             patch('database.DB_PATH', str(tmp_path / 'test_requests.db')):
+    def test_create_request_async_forwarding(self, client, sample_create_payload):
+        """Test that ASYNC_CREATE returns 202 and forwards in the background."""
+        with patch.dict(flask_app.config, {'ASYNC_CREATE': True}), \
+             patch('routes._forward_executor') as mock_executor, \
+             patch('routes._node_session.post') as mock_post:
+            # Run the background job inline
+            mock_executor.submit.side_effect = lambda fn, *args: fn(*args)
             
             mock_response = MagicMock()
             mock_response.status_code = 200
-            mock_response.json.return_value = {"txHash": "0xtxhash789"}
+            mock_response.content = json.dumps({"requestId": "0xasync123"}).encode()
+            mock_post.return_value = mock_response
+            
+            response = client.post('/api/create', 
+                                  json=sample_create_payload,
+                                  content_type='application/json')
+            
+            assert response.status_code == 202
+            data = json.loads(response.data)
+            assert data['state'] == 'Created'
+            mock_executor.submit.assert_called_once()
+            assert database.get_request_id_by_external_requestId('0xasync123') == data['id']
+    
+    def test_create_request_database_persistence(self, client, sample_create_payload):
+        """Test that request data is properly saved to database."""
+        with patch('routes._node_session.post') as mock_post:
+            mock_response = MagicMock()
+            mock_response.status_code = 200
+            mock_response.content = json.dumps({"requestId": "0xrequest789"}).encode()
             mock_post.return_value = mock_response
             
             response = client.post('/api/create', 
@@ -234,22 +286,19 @@ class TestCreateRequestIntegration:
             assert response.status_code == 200
             
             # Verify data was saved to database
-            with sqlite3.connect(str(tmp_path / 'test_requests.db')) as conn:
-                c = conn.cursor()
-                c.execute("SELECT * FROM requests WHERE tx_hash = ?", ("0xtxhash789",))
-                row = c.fetchone()
-                assert row is not None
+            with database.get_conn() as conn:
+                row = conn.execute("SELECT * FROM requests WHERE external_requestId = ?", ("0xrequest789",)).fetchone()
+            assert row is not None
 
 
 class TestUpdateRequestStateIntegration:
-    """Integration tests for the PATCH /api/request/<tx_hash>/<state> endpoint."""
+    """Integration tests for the PATCH /api/request/<external_requestId>/<state> endpoint."""
     
     @pytest.fixture
-    def existing_request(self, app, tmp_path):
+    def existing_request(self, app):
         """Create an existing request in the database."""
-        import database
         request_id = "test-uuid-123"
-        tx_hash = "0xtesthash"
+        external_requestId = "0xtesthash"
         
         database.save_request(
             request_id=request_id,
@@ -263,27 +312,43 @@ class TestUpdateRequestStateIntegration:
             tenant_amf_ip='192.168.1.1',
             tenant_amf_port=38412,
             tenant_nssai_json='[{"sst": 1, "sd": "010203"}]',
-            tx_hash=tx_hash
+            external_requestId=external_requestId
         )
-        return {"request_id": request_id, "tx_hash": tx_hash}
+        return {"request_id": request_id, "external_requestId": external_requestId}
+    
+    @pytest.fixture
+    def make_request(self, app):
+        """Factory for Pending requests with one tenant UE, keyed by external_requestId."""
+        def make(external_requestId, shared_tac='1234', **fields):
+            database.save_request(
+                request_id=f"test-uuid-{external_requestId}",
+                state='Pending',
+                private_key='0xprivate',
+                contract_address='0xcontract',
+                shared_tac=shared_tac,
+                ue_imsis_json='["001010000000001"]',
+                external_requestId=external_requestId,
+                **fields
+            )
+        return make
     
     def test_update_request_to_rejected(self, client, existing_request):
         """Test updating request state to rejected."""
-        tx_hash = existing_request['tx_hash']
+        external_requestId = existing_request['external_requestId']
         
-        response = client.patch(f'/api/request/{tx_hash}/rejected')
+        response = client.patch(f'/api/request/{external_requestId}/rejected')
         
         assert response.status_code == 200
         data = json.loads(response.data)
         assert data['success'] is True
         assert data['state'] == 'Rejected'
-        assert data['txHash'] == tx_hash
+        assert data['external_requestId'] == external_requestId
     
     def test_update_request_to_completed(self, client, existing_request):
         """Test updating request state to completed."""
-        tx_hash = existing_request['tx_hash']
+        external_requestId = existing_request['external_requestId']
         
-        response = client.patch(f'/api/request/{tx_hash}/completed')
+        response = client.patch(f'/api/request/{external_requestId}/completed')
         
         assert response.status_code == 200
         data = json.loads(response.data)
@@ -292,7 +357,7 @@ class TestUpdateRequestStateIntegration:
     
     def test_update_request_to_accepted_agent_success(self, client, existing_request):
         """Test updating request state to accepted with successful agent calls."""
-        tx_hash = existing_request['tx_hash']
+        external_requestId = existing_request['external_requestId']
         
         with patch('routes.call_agent_restart') as mock_restart, \
              patch('routes.call_agent_get_all_ues') as mock_get_ues, \
@@ -306,12 +371,12 @@ class TestUpdateRequestStateIntegration:
             # Mock successful get UEs
             mock_ues_response = MagicMock()
             mock_ues_response.status_code = 200
-            mock_ues_response.json.return_value = {
+            mock_ues_response.content = json.dumps({
                 "ues": [
                     {"imsi": "001010000000001"},
                     {"imsi": "001010000000003"}  # This one should be updated
                 ]
-            }
+            }).encode()
             mock_get_ues.return_value = mock_ues_response
             
             # Mock successful update UEs
@@ -319,7 +384,7 @@ class TestUpdateRequestStateIntegration:
             mock_update_response.status_code = 200
             mock_update_ues.return_value = mock_update_response
             
-            response = client.patch(f'/api/request/{tx_hash}/accepted')
+            response = client.patch(f'/api/request/{external_requestId}/accepted')
             
             assert response.status_code == 200
             data = json.loads(response.data)
@@ -332,7 +397,7 @@ class TestUpdateRequestStateIntegration:
     
     def test_update_request_to_accepted_agent_restart_fails(self, client, existing_request):
         """Test handling of agent restart failure during acceptance."""
-        tx_hash = existing_request['tx_hash']
+        external_requestId = existing_request['external_requestId']
         
         with patch('routes.call_agent_restart') as mock_restart:
             # Mock failed agent restart
@@ -340,7 +405,7 @@ class TestUpdateRequestStateIntegration:
             mock_restart_response.status_code = 500
             mock_restart.return_value = mock_restart_response
             
-            response = client.patch(f'/api/request/{tx_hash}/accepted')
+            response = client.patch(f'/api/request/{external_requestId}/accepted')
             
             assert response.status_code == 500
             data = json.loads(response.data)
@@ -349,7 +414,7 @@ class TestUpdateRequestStateIntegration:
     
     def test_update_request_to_accepted_no_ues_to_update(self, client, existing_request):
         """Test accepting request when all UEs are in the allowed list."""
-        tx_hash = existing_request['tx_hash']
+        external_requestId = existing_request['external_requestId']
         
         with patch('routes.call_agent_restart') as mock_restart, \
              patch('routes.call_agent_get_all_ues') as mock_get_ues:
@@ -362,33 +427,197 @@ class TestUpdateRequestStateIntegration:
             # Mock get UEs - only UEs that are in ue_imsis
             mock_ues_response = MagicMock()
             mock_ues_response.status_code = 200
-            mock_ues_response.json.return_value = {
+            mock_ues_response.content = json.dumps({
                 "ues": [
                     {"imsi": "001010000000001"},
                     {"imsi": "001010000000002"}
                 ]
-            }
+            }).encode()
             mock_get_ues.return_value = mock_ues_response
             
-            response = client.patch(f'/api/request/{tx_hash}/accepted')
+            response = client.patch(f'/api/request/{external_requestId}/accepted')
             
             assert response.status_code == 200
             data = json.loads(response.data)
             assert data['success'] is True
     
+    def test_update_request_to_accepted_skips_unchanged_ues(self, client, make_request):
+        """Test that UEs already restricted to the shared TAC are not sent to the agent."""
+        make_request("0xunchanged", tenant_plmn='00101')
+        
+        with patch('routes.call_agent_restart') as mock_restart, \
+             patch('routes.call_agent_get_all_ues') as mock_get_ues, \
+             patch('routes.call_agent_update_ues') as mock_update_ues:
+            
+            mock_restart.return_value = MagicMock(status_code=200)
+            
+            restricted = {
+                "restriction_type": "not_allowed",
+                "tais": [{"plmn": "00101", "areas": [{"tacs": [1234]}]}]
+            }
+            mock_ues_response = MagicMock()
+            mock_ues_response.status_code = 200
+            mock_ues_response.content = json.dumps({
+                "ues": [
+                    {"imsi": "001010000000003", "allowed_5gs_tais": restricted},
+                    {"imsi": "001010000000004"}
+                ]
+            }).encode()
+            mock_get_ues.return_value = mock_ues_response
+            mock_update_ues.return_value = MagicMock(status_code=200)
+            
+            response = client.patch('/api/request/0xunchanged/accepted')
+            
+            assert response.status_code == 200
+            sent_ues = mock_update_ues.call_args[0][1]
+            assert [ue['imsi'] for ue in sent_ues] == ["001010000000004"]
+    
+    def test_update_request_to_accepted_reads_agent_ue_list(self, client, make_request):
+        """Test that the UE list in the agent's get_all_ues reply reaches the accepted handler."""
+        make_request("0xuelist")
+        agent_reply = requests.Response()
+        agent_reply.status_code = 200
+        agent_reply._content = b'{"ues": [{"imsi": "001010000000002"}]}'
+        
+        # Real call_agent_get_all_ues, with only the HTTP call to the agent mocked
+        with patch('routes.call_agent_get_all_ues', utils.call_agent_get_all_ues), \
+             patch('utils._SESSION.patch', return_value=agent_reply), \
+             patch('routes.call_agent_update_ues') as mock_update_ues:
+            mock_update_ues.return_value = MagicMock(status_code=200)
+            
+            response = client.patch('/api/request/0xuelist/accepted')
+        
+        assert response.status_code == 200
+        sent_ues = mock_update_ues.call_args[0][1]
+        assert [ue['imsi'] for ue in sent_ues] == ["001010000000002"]
+        assert database.get_request_data_by_external_requestId("0xuelist")['state'] == 'Completed'
+    
+    def test_update_request_to_accepted_reuses_cached_ues(self, client, make_request):
+        """Test that AGENT_UES_CACHE_TTL reuses get_all_ues until update_ues runs."""
+        make_request("0xcache1")
+        make_request("0xcache2")
+        make_request("0xcache3", shared_tac='5678')
+        
+        with patch.dict(flask_app.config, {'AGENT_UES_CACHE_TTL': 60.0}), \
+             patch('routes._ues_cache', {}) as ues_cache, \
+             patch('routes.call_agent_restart') as mock_restart, \
+             patch('routes.call_agent_get_all_ues') as mock_get_ues, \
+             patch('routes.call_agent_update_ues') as mock_update_ues:
+            mock_restart.return_value = MagicMock(status_code=200)
+            mock_get_ues.return_value = MagicMock(status_code=200, content=json.dumps({"ues": [
+                {"imsi": "001010000000002", "allowed_5gs_tais": {
+                    "restriction_type": "not_allowed",
+                    "tais": [{"plmn": "00101", "areas": [{"tacs": [1234]}]}]}}
+            ]}).encode())
+            mock_update_ues.return_value = MagicMock(status_code=200)
+            
+            # TAC 1234 is already restricted, so the second request reuses the cached UE list
+            assert client.patch('/api/request/0xcache1/accepted').status_code == 200
+            assert client.patch('/api/request/0xcache2/accepted').status_code == 200
+            assert mock_get_ues.call_count == 1
+            mock_update_ues.assert_not_called()
+            
+            # TAC 5678 needs an update, which drops the cache entry
+            assert client.patch('/api/request/0xcache3/accepted').status_code == 200
+            assert mock_get_ues.call_count == 1
+            mock_update_ues.assert_called_once()
+            assert ues_cache == {}
+    
+    def test_update_request_to_accepted_cached_ues_keep_both_tacs(self, client, make_request):
+        """Test that two cached accepts with different shared TACs on one UE both keep their TAC."""
+        make_request("0xtac1")
+        make_request("0xtac2", shared_tac='5678')
+        
+        # Fake agent holding one non-tenant UE; update_ues replaces the stored UEs
+        agent_ues = {"001010000000002": {"imsi": "001010000000002", "allowed_5gs_tais": {
+            "restriction_type": "not_allowed",
+            "tais": [{"plmn": "00101", "areas": [{"tacs": []}]}]}}}
+        
+        def get_all_ues(agent_url):
+            return MagicMock(status_code=200, content=json.dumps({"ues": list(agent_ues.values())}).encode())
+        
+        def update_ues(agent_url, ues, batch_size=0):
+            agent_ues.update({ue['imsi']: json.loads(json.dumps(ue)) for ue in ues})
+            return MagicMock(status_code=200)
+        
+        with patch.dict(flask_app.config, {'AGENT_UES_CACHE_TTL': 60.0}), \
+             patch('routes._ues_cache', {}), \
+             patch('routes.call_agent_get_all_ues', side_effect=get_all_ues), \
+             patch('routes.call_agent_update_ues', side_effect=update_ues):
+            assert client.patch('/api/request/0xtac1/accepted').status_code == 200
+            assert client.patch('/api/request/0xtac2/accepted').status_code == 200
+        
+        tacs = agent_ues["001010000000002"]["allowed_5gs_tais"]["tais"][0]["areas"][0]["tacs"]
+        assert tacs == [1234, 5678]
+    
+    def test_cached_ues_not_refilled_across_invalidation(self, app):
+        """Test that a get_all_ues that overlapped an invalidation is not cached."""
+        fetch_started = threading.Event()
+        release_fetch = threading.Event()
+        
+        def slow_get_all_ues(agent_url):
+            fetch_started.set()
+            release_fetch.wait(5)
+            return MagicMock(status_code=200, content=b'{"ues": []}')
+        
+        def fetch():
+            with app.app_context():
+                routes._get_all_ues('http://agent')
+        
+        with patch.dict(flask_app.config, {'AGENT_UES_CACHE_TTL': 60.0}), \
+             patch('routes._ues_cache', {}) as ues_cache, \
+             patch('routes._ues_cache_gen', {}), \
+             patch('routes.call_agent_get_all_ues', side_effect=slow_get_all_ues):
+            fetcher = threading.Thread(target=fetch)
+            fetcher.start()
+            assert fetch_started.wait(5)
+            
+            # An update_ues finishes while the fetch is still waiting on the agent
+            routes._invalidate_ues_cache('http://agent')
+            release_fetch.set()
+            fetcher.join(5)
+            
+            assert ues_cache == {}
+    
+    def test_update_request_to_accepted_async(self, client, make_request):
+        """Test that ASYNC_ACCEPT returns 202 and applies the configuration in the background."""
+        make_request("0xasyncaccept")
+        
+        with patch.dict(flask_app.config, {'ASYNC_ACCEPT': True}), \
+             patch('routes._accept_executor') as mock_executor, \
+             patch('routes.call_agent_restart') as mock_restart, \
+             patch('routes.call_agent_get_all_ues') as mock_get_ues:
+            mock_restart.return_value = MagicMock(status_code=200)
+            mock_get_ues.return_value = MagicMock(status_code=200, content=b'{"ues": []}')
+            
+            response = client.patch('/api/request/0xasyncaccept/accepted')
+            
+            assert response.status_code == 202
+            assert json.loads(response.data)['state'] == 'Accepted'
+            row = database.get_request_data_by_external_requestId("0xasyncaccept")
+            assert row['state'] == 'Accepted'
+            
+            # Run the submitted job inline
+            job, *args = mock_executor.submit.call_args[0]
+            job(*args)
+            
+            mock_restart.assert_called_once()
+            row = database.get_request_data_by_external_requestId("0xasyncaccept")
+            assert row['state'] == 'Completed'
+    
     def test_update_request_invalid_state(self, client, existing_request):
         """Test that invalid state returns 400 error."""
-        tx_hash = existing_request['tx_hash']
+        external_requestId = existing_request['external_requestId']
         
-        response = client.patch(f'/api/request/{tx_hash}/invalid_state')
+        response = client.patch(f'/api/request/{external_requestId}/invalid_state')
         
         assert response.status_code == 400
         data = json.loads(response.data)
         assert 'error' in data
         assert 'Invalid state' in data['error']
     
-    def test_update_request_nonexistent_tx_hash(self, client):
-        """Test updating a request with nonexistent tx_hash."""
+    def test_update_request_nonexistent_external_requestId(self, client):
+        """Test updating a request with a nonexistent external_requestId."""
         response = client.patch('/api/request/0xnonexistent/rejected')
         
         assert response.status_code == 404
@@ -398,9 +627,9 @@ class TestUpdateRequestStateIntegration:
     
     def test_update_request_state_case_insensitive(self, client, existing_request):
         """Test that state parameter is case-insensitive."""
-        tx_hash = existing_request['tx_hash']
+        external_requestId = existing_request['external_requestId']
         
-        response = client.patch(f'/api/request/{tx_hash}/REJECTED')
+        response = client.patch(f'/api/request/{external_requestId}/REJECTED')
         
         assert response.status_code == 200
         data = json.loads(response.data)
@@ -413,10 +642,10 @@ class TestEndToEndFlow:
     def test_create_and_update_workflow(self, client, sample_create_payload):
         """Test complete workflow: create request, then update its state."""
         # Step 1: Create request
-        with patch('routes.requests.post') as mock_post:
+        with patch('routes._node_session.post') as mock_post:
             mock_response = MagicMock()
             mock_response.status_code = 200
-            mock_response.json.return_value = {"txHash": "0xworkflow123"}
+            mock_response.content = json.dumps({"requestId": "0xworkflow123"}).encode()
             mock_post.return_value = mock_response
             
             create_response = client.post('/api/create', 
@@ -424,23 +653,23 @@ class TestEndToEndFlow:
                                          content_type='application/json')
             
             assert create_response.status_code == 200
-            tx_hash = json.loads(create_response.data)['txHash']
+            external_requestId = json.loads(create_response.data)['requestId']
         
         # Step 2: Update to rejected
-        update_response = client.patch(f'/api/request/{tx_hash}/rejected')
+        update_response = client.patch(f'/api/request/{external_requestId}/rejected')
         
         assert update_response.status_code == 200
         data = json.loads(update_response.data)
         assert data['state'] == 'Rejected'
-        assert data['txHash'] == tx_hash
+        assert data['external_requestId'] == external_requestId
     
     def test_create_and_accept_with_full_agent_flow(self, client, sample_create_payload):
         """Test full acceptance workflow with all agent interactions."""
         # Step 1: Create request
-        with patch('routes.requests.post') as mock_post:
+        with patch('routes._node_session.post') as mock_post:
             mock_response = MagicMock()
             mock_response.status_code = 200
-            mock_response.json.return_value = {"txHash": "0xfullflow123"}
+            mock_response.content = json.dumps({"requestId": "0xfullflow123"}).encode()
             mock_post.return_value = mock_response
             
             create_response = client.post('/api/create', 
@@ -448,7 +677,7 @@ class TestEndToEndFlow:
                                          content_type='application/json')
             
             assert create_response.status_code == 200
-            tx_hash = json.loads(create_response.data)['txHash']
+            external_requestId = json.loads(create_response.data)['requestId']
         
         # Step 2: Accept with full agent workflow
         with patch('routes.call_agent_restart') as mock_restart, \
@@ -462,19 +691,19 @@ class TestEndToEndFlow:
             
             mock_ues_response = MagicMock()
             mock_ues_response.status_code = 200
-            mock_ues_response.json.return_value = {
+            mock_ues_response.content = json.dumps({
                 "ues": [
                     {"imsi": "001010000000001"},
                     {"imsi": "001010000000003"}
                 ]
-            }
+            }).encode()
             mock_get_ues.return_value = mock_ues_response
             
             mock_update_response = MagicMock()
             mock_update_response.status_code = 200
             mock_update_ues.return_value = mock_update_response
             
-            accept_response = client.patch(f'/api/request/{tx_hash}/accepted')
+            accept_response = client.patch(f'/api/request/{external_requestId}/accepted')
             
             assert accept_response.status_code == 200
             data = json.loads(accept_response.data)
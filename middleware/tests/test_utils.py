@@ -1,6 +1,6 @@
-import pytest
 from unittest.mock import patch, MagicMock
 import json
+import requests
 
 import sys
 import os
@@ -13,8 +13,8 @@ from utils import (
     call_agent_update_ues,
     _build_payload,
     _create_error_response,
+    AGENT_TIMEOUT,
     DEFAULT_GNB_ID,
-    RESTART_PARAM_MAPPING,
 )
 
 
@@ -70,7 +70,7 @@ class TestCreateErrorResponse:
 
 
 class TestCallAgent:
-    @patch('utils.requests.patch')
+    @patch('utils._SESSION.patch')
     def test_successful_call(self, mock_patch):
         """Test successful agent call."""
         mock_response = MagicMock()
@@ -85,7 +85,7 @@ class TestCallAgent:
         assert f'/resource/{DEFAULT_GNB_ID}' in call_args[0][0]
         assert result.status_code == 200
     
-    @patch('utils.requests.patch')
+    @patch('utils._SESSION.patch')
     def test_url_formatting(self, mock_patch):
         """Test that URL is correctly formatted."""
         mock_response = MagicMock()
@@ -102,10 +102,9 @@ class TestCallAgent:
         url = mock_patch.call_args[0][0]
         assert url == f'http://localhost:4000/resource/{DEFAULT_GNB_ID}'
     
-    @patch('utils.requests.patch')
+    @patch('utils._SESSION.patch')
     def test_request_exception_returns_error_response(self, mock_patch):
         """Test that request exceptions return error response."""
-        import requests
         mock_patch.side_effect = requests.exceptions.RequestException("Connection failed")
         
         result = call_agent('test_action', 'http://localhost:4000')
@@ -113,7 +112,18 @@ class TestCallAgent:
         assert result.status_code == 500
         assert result.content == b"Internal Server Error"
     
-    @patch('utils.requests.patch')
+    @patch('utils._SESSION.patch')
+    def test_http_error_returns_error_response(self, mock_patch):
+        """Test that a 4xx/5xx from the agent returns an error response with its status."""
+        mock_patch.return_value = MagicMock(status_code=503, text="Service Unavailable")
+        
+        result = call_agent('test_action', 'http://localhost:4000')
+        
+        assert result.status_code == 503
+        assert result.content == b"Service Unavailable"
+        assert not result.ok
+    
+    @patch('utils._SESSION.patch')
     def test_payload_sent_as_json(self, mock_patch):
         """Test that payload is sent as JSON."""
         mock_response = MagicMock()
@@ -127,6 +137,30 @@ class TestCallAgent:
         
         sent_data = json.loads(call_kwargs['data'])
         assert sent_data['activation_feature'][0]['name'] == 'gNodeB_service'
+    
+    @patch('utils._SESSION.patch')
+    def test_get_all_ues_body_returned(self, mock_patch):
+        """Test that the UE list in a get_all_ues response reaches the caller."""
+        # A real Response, so replacing its body would show in content
+        agent_reply = requests.Response()
+        agent_reply.status_code = 200
+        agent_reply._content = b'{"ues": [{"imsi": "001010000045613"}]}'
+        mock_patch.return_value = agent_reply
+        
+        result = call_agent('get_all_ues', 'http://localhost:4000')
+        
+        assert json.loads(result.content) == {"ues": [{"imsi": "001010000045613"}]}
+    
+    @patch('utils._SESSION.patch')
+    def test_timeout_passed(self, mock_patch):
+        """Test that agent calls always carry a (connect, read) timeout."""
+        mock_patch.return_value = MagicMock(status_code=200)
+        
+        call_agent('test_action', 'http://localhost:4000')
+        assert mock_patch.call_args[1]['timeout'] == AGENT_TIMEOUT
+        
+        call_agent('test_action', 'http://localhost:4000', timeout=(1, 2))
+        assert mock_patch.call_args[1]['timeout'] == (1, 2)
 
 
 class TestCallAgentRestart:
@@ -154,6 +188,7 @@ class TestCallAgentRestart:
         assert params['PRMT_NSSAI_TENANT'] == [{"sst": 1}]
         assert params['PRMT_PLMN_TENANT'] == '00101'
         assert params['PRMT_TAC_TENANT'] == 101
+        assert list(params) == ['PRMT_AMF_ADDR_TENANT', 'PRMT_NSSAI_TENANT', 'PRMT_PLMN_TENANT', 'PRMT_TAC_TENANT']
     
     @patch('utils.call_agent')
     def test_restart_with_partial_params(self, mock_call_agent):
@@ -241,3 +276,27 @@ class TestCallAgentUpdateUes:
         call_agent_update_ues('http://localhost:4000', [])
         
         mock_call_agent.assert_called_once_with('update_ues', 'http://localhost:4000', [])
+    
+    @patch('utils.call_agent')
+    def test_update_ues_in_batches(self, mock_call_agent):
+        """Test that UEs are split into batches of batch_size."""
+        mock_call_agent.return_value = MagicMock(status_code=200)
+        ues = [{"imsi": str(i)} for i in range(5)]
+        
+        response = call_agent_update_ues('http://localhost:4000', ues, batch_size=2)
+        
+        assert response.status_code == 200
+        batches = sorted((c[0][2] for c in mock_call_agent.call_args_list), key=lambda b: b[0]['imsi'])
+        assert batches == [ues[0:2], ues[2:4], ues[4:5]]
+    
+    @patch('utils.call_agent')
+    def test_update_ues_batch_failure_returned(self, mock_call_agent):
+        """Test that a failed batch makes the whole update fail."""
+        mock_call_agent.side_effect = lambda action, url, batch: MagicMock(
+            status_code=500 if batch[0]['imsi'] == '2' else 200)
+        ues = [{"imsi": str(i)} for i in range(4)]
+        
+        response = call_agent_update_ues('http://localhost:4000', ues, batch_size=2)
+        
+        assert response.status_code == 500
+